@@ -1,10 +1,76 @@
 import os  # file and directory ha
 import fitz  # PyMuPDF
-import re  # regex 
 import argparse  # command line arguments
 import shutil  # file operations
+import io  # in-memory text buffers
+import mmap  # memory-mapped file reading
+from contextlib import redirect_stdout  # capture worker output
+from concurrent.futures import ProcessPoolExecutor, as_completed  # parallel processing
 
-def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
+def extract_age(text):
+    """
+    Find the first age in the form "(<digits> años)" in the text.
+    Uses plain string searching, which is cheaper than a regex on the short
+    strings extracted from each rectangle.
+    
+    Args:
+        text (str): Text to search
+    
+    Returns:
+        str: The age as "(<digits> años)", or None if not found
+    """
+    idx = text.find(' años)')
+    while idx >= 0:
+        # Walk back over the digits to the opening parenthesis
+        start = idx
+        while start > 0 and text[start - 1].isdecimal():
+            start -= 1
+        if start < idx and start > 0 and text[start - 1] == '(':
+            return f"({text[start:idx]} años)"
+        idx = text.find(' años)', idx + 1)
+    return None
+
+def link_or_copy(src, dst):
+    """
+    Place a file at dst by hard-linking it to src, which moves no data.
+    Falls back to a regular copy when linking is not possible, e.g. across
+    filesystems. An existing file at dst is replaced, as with a copy.
+    
+    Args:
+        src (str or Path): Path to the source file
+        dst (str or Path): Path to the destination file
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return  # Already linked, e.g. by a previous run
+        # Replace rather than write through an existing link to another file
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def open_pdf_mapped(pdf_path):
+    """
+    Open a PDF from a read-only memory map of the file instead of having
+    PyMuPDF read it, so pages are loaded lazily by the OS.
+    The mapping is released once the returned document is garbage collected.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+    
+    Returns:
+        fitz.Document: The opened document
+    """
+    try:
+        with open(pdf_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return fitz.open(stream=memoryview(mm), filetype="pdf")
+    except Exception as e:
+        # Errors from a stream don't say which file it was
+        raise RuntimeError(f"Failed to open {pdf_path}: {e}") from e
+
+def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True, optimize=False):
     """
     Redact text in a PDF file based on coordinates with horizontal mirroring applied.
     Extracts gender and age information before redaction and adds it back on top.
@@ -17,6 +83,8 @@ def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
             representing the areas to redact
         output_dir (str, optional): Directory to save the output file
         include_info (bool): Whether to include gender and age info in the output (default: True)
+        optimize (bool): Whether to save with maximum garbage collection and compression
+            (default: False)
     
     Returns:
         str: Path to the redacted PDF file, or None if processing failed
@@ -34,21 +102,26 @@ def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
         output_path = os.path.join(dir_name, f"{base_name_no_ext}_censored{ext}")
     
     # Open the PDF file
-    doc = fitz.open(pdf_path)
+    doc = open_pdf_mapped(pdf_path)
     
     try:
         # Check if the document has at least one page
         if len(doc) == 0:
-            print("Error: The PDF file has no pages.")
+            print(f"Error: The PDF file {base_name} has no pages.")
             return None
         
         # Get the first page
         page = doc[0]
         
-        # Check if PDF is scanned (has no extractable text)
-        page_text = page.get_text().strip()
-        if not page_text:
-            print("Error: PDF appears to be scanned (no extractable text found).")
+        # Check if PDF is scanned (has no extractable text). A page without fonts
+        # in its resources, annotations or form fields cannot contain text, and
+        # this check avoids interpreting the page content (and decoding its images).
+        # Annotations and form fields bring their own fonts, so any other page
+        # still has its text extracted
+        is_scanned = (not page.get_fonts() and page.first_annot is None
+                      and page.first_widget is None)
+        if is_scanned or not page.get_text().strip():
+            print(f"Error: {base_name} appears to be scanned (no extractable text found).")
             return None
         
         # Flag to track if we need to create a single-page document
@@ -64,25 +137,18 @@ def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
         for page_num, rect_list in coordinates_dict.items():
             all_rectangles.extend(rect_list)
         
-        # Dictionary to store extracted information for each rectangle
-        extracted_info = {}
+        # Build all redaction rectangles up front, applying the horizontal mirroring
+        # transformation; rectangles without 4 coordinates are skipped
+        redact_rects = [
+            fitz.Rect(x1, page_width - y2, x2, page_width - y1)
+            for x1, y1, x2, y2 in (rect for rect in all_rectangles if len(rect) == 4)
+        ]
         
-        # First pass: Extract text from each rectangle before redaction
-        for i, rect in enumerate(all_rectangles):
-            #print(f"Processing rectangle: {rect}")
-            if len(rect) != 4:
-                #print(f"Warning: Invalid rectangle format {rect}. Skipping.")
-                continue
-            
-            # Extract coordinates
-            x1, y1, x2, y2 = rect
-            
-            # Apply horizontal mirroring transformation
-            y1_transformed, y2_transformed = page_width - y2, page_width - y1
-            
-            # Create a rectangle from the transformed coordinates
-            redact_rect = fitz.Rect(x1, y1_transformed, x2, y2_transformed)
-            
+        # (rect, gender, age) for each rectangle where information was found
+        extracted_info = []
+        
+        # Extract text from each rectangle before redaction
+        for redact_rect in redact_rects:
             # Extract text from the rectangle area
             text = page.get_text("text", clip=redact_rect)
             #print(f"Extracted text: {text}")
@@ -94,81 +160,66 @@ def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
             elif "Femenino" in text:
                 gender = "Femenino"
                 
-            # Extract age information using regex
-            age = None
-            age_match = re.search(r'\((\d+) años\)', text)
-            if age_match:
-                age = f"({age_match.group(1)} años)"
+            # Extract age information
+            age = extract_age(text)
                 
             if gender or age:
-                extracted_info[i] = {
-                    "rect": redact_rect,
-                    "gender": gender,
-                    "age": age
-                }
+                extracted_info.append((redact_rect, gender, age))
                 #print(f"Found information: Gender={gender}, Age={age}")
         if not extracted_info:
             #print(f"Error: Could not extract gender or age information from {os.path.basename(pdf_path)}")
             return None
             
         # If this is a multi-page document, create a new document with just the first page
+        # before annotating, so redactions are added to the page that gets saved
         if is_multi_page:
-            print(f"PDF has {len(doc)} pages. Extracting only the first page...")
+            print(f"{base_name} has {len(doc)} pages. Extracting only the first page...")
             new_doc = fitz.open()
             new_doc.insert_pdf(doc, from_page=0, to_page=0)
             doc.close()
             doc = new_doc
             page = doc[0]  # Get the page from the new document
         
-        # Second pass: Apply redactions
-        for i, rect in enumerate(all_rectangles):
-            if len(rect) != 4:
-                continue
-                
-            # Extract coordinates
-            x1, y1, x2, y2 = rect
-            
-            # Apply horizontal mirroring transformation
-            y1_transformed, y2_transformed = page_width - y2, page_width - y1
-            
-            # Create a rectangle from the transformed coordinates
-            redact_rect = fitz.Rect(x1, y1_transformed, x2, y2_transformed)
-            #print(f"Redacting rectangle: {redact_rect}")
-            
-            # Add a redaction annotation with black fill
-            annot = page.add_redact_annot(redact_rect, fill=(0, 0, 0))
-            
+        # Add a redaction annotation with black fill for each rectangle
+        for redact_rect in redact_rects:
+            page.add_redact_annot(redact_rect, fill=(0, 0, 0))
+        
         # Apply all redactions on this page
         page.apply_redactions()
         
-        # Third pass: Add extracted information back on top of redacted areas (if include_info is True)
+        # Add extracted information back on top of redacted areas (if include_info is True)
         if include_info:
-            for i, info in extracted_info.items():
-                rect = info["rect"]
-                text_items = []
+            # All entries are written at the same fixed position, so join them into a
+            # single text (dropping repeats) and insert it with one call
+            text_items = []
+            for rect, gender, age in extracted_info:
+                if gender:
+                    text_items.append(gender)
+                if age:
+                    text_items.append(age)
+            
+            if text_items:
+                text = " ".join(dict.fromkeys(text_items))
+                
+                # Position text in the middle of the redaction box
+                text_point = fitz.Point(90, 784)
                 
-                if info["gender"]:
-                    text_items.append(info["gender"])
-                if info["age"]:
-                    text_items.append(info["age"])
-                    
-                if text_items:
-                    text = " ".join(text_items)
-                    
-                    # Position text in the middle of the redaction box
-                    text_point = fitz.Point(90, 784)
-                    
-                    page.insert_text(
-                        text_point,
-                        text,
-                        fontsize=10,
-                        color=(1, 1, 1),  # White text
-                        rotate=90
-                    )
-                    #print(f"Added text '{text}' on top of redacted area")
+                page.insert_text(
+                    text_point,
+                    text,
+                    fontsize=10,
+                    color=(1, 1, 1),  # White text
+                    rotate=90
+                )
+                #print(f"Added text '{text}' on top of redacted area")
     
-        # Save the redacted PDF 
-        doc.save(output_path, garbage=4, deflate=True)
+        # Save the redacted PDF. By default only remove unused objects and skip
+        # recompressing images and fonts
+        if optimize:
+            doc.save(output_path, garbage=4, deflate=True)
+        else:
+            doc.save(output_path, garbage=1, deflate=True, deflate_images=False,
+                     deflate_fonts=False, clean=False)
         
         if is_multi_page:
             print(f"Redacted first page of multi-page PDF saved as: {output_path}")
@@ -182,7 +233,26 @@ def censor_pdf(pdf_path, coordinates_dict, output_dir=None, include_info=True):
         doc.close()
 
 
-def process_pdf_folder(folder_path, coordinates_dict, output_dir=None, include_info=True):
+def _censor_pdf_worker(pdf_path, coordinates_dict, output_dir, include_info, optimize):
+    """
+    Run censor_pdf in a worker process, capturing everything it prints so the
+    parent can print it in one piece instead of interleaved with other files.
+    
+    Returns:
+        tuple: (output_path, error, log) where error is the exception message
+            if censor_pdf raised, otherwise None
+    """
+    log = io.StringIO()
+    with redirect_stdout(log):
+        try:
+            output_path = censor_pdf(pdf_path, coordinates_dict, output_dir, include_info, optimize)
+            error = None
+        except Exception as e:
+            output_path, error = None, str(e)
+    return output_path, error, log.getvalue()
+
+
+def process_pdf_folder(folder_path, coordinates_dict, output_dir=None, include_info=True, optimize=False):
     """
     Process all PDF files in a folder, applying censorship to each one.
     
@@ -191,6 +261,7 @@ def process_pdf_folder(folder_path, coordinates_dict, output_dir=None, include_i
         coordinates_dict (dict): Dictionary of coordinates for redaction
         output_dir (str, optional): Custom output directory
         include_info (bool): Whether to include gender/age info in output (default: True)
+        optimize (bool): Whether to save with maximum compression (default: False)
         
     Returns:
         list: List of paths to the redacted PDF files
@@ -213,35 +284,41 @@ def process_pdf_folder(folder_path, coordinates_dict, output_dir=None, include_i
         print(f"Error: Folder '{folder_path}' does not exist.")
         return processed_files
     
-    # Process each PDF file in the folder
-    for file_name in os.listdir(folder_path):
-        if file_name.lower().endswith('.pdf'):
-            pdf_path = os.path.join(folder_path, file_name)
-            try:
-                #print(f"Processing file: {file_name}")
-                output_path = censor_pdf(pdf_path, coordinates_dict, output_dir, include_info)
-                if output_path:
-                    processed_files.append(output_path)
-                else:
-                    # If censor_pdf returns None, it means processing failed
-                    failed_files.append(file_name)
-                    # Copy failed file to Failed folder
-                    os.makedirs(failed_dir, exist_ok=True)
-                    failed_file_path = os.path.join(failed_dir, file_name)
-                    shutil.copy2(pdf_path, failed_file_path)
-            except Exception as e:
-                print(f"Error processing {file_name}: {str(e)}")
+    # os.scandir entries know whether they are files without an extra stat() call
+    with os.scandir(folder_path) as it:
+        pdf_entries = [e for e in it if e.is_file() and e.name.lower().endswith('.pdf')]
+    
+    # Process the PDF files in parallel, one censor_pdf call per file
+    with ProcessPoolExecutor() as executor:
+        futures = {
+            executor.submit(_censor_pdf_worker, entry.path, coordinates_dict, output_dir,
+                            include_info, optimize): entry
+            for entry in pdf_entries
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            file_name = entry.name
+            output_path, error, log = future.result()
+            # Print the worker's messages together so files don't interleave
+            if log:
+                print(log, end="")
+            if error is not None:
+                print(f"Error processing {file_name}: {error}")
+            if output_path:
+                processed_files.append(output_path)
+            else:
+                # If censor_pdf returns None or raised, processing failed
                 failed_files.append(file_name)
-                # Copy failed file to Failed folder
+                # Link (or copy) failed file to Failed folder
                 os.makedirs(failed_dir, exist_ok=True)
                 failed_file_path = os.path.join(failed_dir, file_name)
-                shutil.copy2(pdf_path, failed_file_path)
+                link_or_copy(entry.path, failed_file_path)
     
     print(f"Processed {len(processed_files)} PDF files. Saved to: {output_dir}")
     
     # Print list of failed files if any
     if failed_files:
-        print(f"Failed to process {len(failed_files)} files (copied to {failed_dir}):")
+        print(f"Failed to process {len(failed_files)} files (linked or copied to {failed_dir}):")
         for failed_file in failed_files:
             print(f"  - {failed_file}")
     
@@ -265,6 +342,10 @@ if __name__ == "__main__":
     parser.add_argument('--no-info', action='store_true',
                        help='Do not include gender and age information in the censored PDFs')
     
+    # Add option to trade save speed for smaller output files
+    parser.add_argument('--optimize', action='store_true',
+                       help='Save censored PDFs with maximum garbage collection and compression (slower)')
+    
     # Parse arguments
     args = parser.parse_args()
     
@@ -282,7 +363,7 @@ if __name__ == "__main__":
     if args.folder:
         output_dir = args.output if args.output else None
         folder_path = args.folder
-        processed_files = process_pdf_folder(folder_path, coordinates, output_dir, include_info)
+        processed_files = process_pdf_folder(folder_path, coordinates, output_dir, include_info, args.optimize)
     elif args.file:
         output_dir = args.output if args.output else None
-        redacted_pdf = censor_pdf(args.file, coordinates, output_dir, include_info)
+        redacted_pdf = censor_pdf(args.file, coordinates, output_dir, include_info, args.optimize)
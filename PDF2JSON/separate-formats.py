@@ -3,17 +3,21 @@
 ECG PDF Format Validator and Sorter
 
 This script validates a folder of PDF files to check if they contain properly formatted ECGs.
-Valid PDFs are copied to format-specific subfolders within the 'Correct' folder,
-while invalid ones go to an 'Incorrect' folder.
+Valid PDFs are hard-linked (or copied, when the output is on another drive) to
+format-specific subfolders within the 'Correct' folder, while invalid ones go to an
+'Incorrect' folder. Editing a linked file in place also changes the input file.
 """
 
 import os
 import shutil
+import io
+import mmap
 import argparse
 from pathlib import Path
 import fitz  # PyMuPDF
-import re
 from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
 
 # Define the expected formats
 FORMAT1_TITLES = {
@@ -52,51 +56,108 @@ ECG_FORMATS = {
     "format2": FORMAT2_TITLES
 }
 
+def link_or_copy(src, dst):
+    """
+    Place a file at dst by hard-linking it to src, which moves no data.
+    Falls back to a regular copy when linking is not possible, e.g. across
+    filesystems. An existing file at dst is replaced, as with a copy.
+    
+    Args:
+        src (str or Path): Path to the source file
+        dst (str or Path): Path to the destination file
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return  # Already linked, e.g. by a previous run
+        # Replace rather than write through an existing link to another file
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def open_pdf_mapped(pdf_path):
+    """
+    Open a PDF from a read-only memory map of the file instead of having
+    PyMuPDF read it, so pages are loaded lazily by the OS.
+    The mapping is released once the returned document is garbage collected.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+    
+    Returns:
+        fitz.Document: The opened document
+    """
+    try:
+        with open(pdf_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return fitz.open(stream=memoryview(mm), filetype="pdf")
+    except Exception as e:
+        # Errors from a stream don't say which file it was
+        raise RuntimeError(f"Failed to open {pdf_path}: {e}") from e
+
 def extract_text_from_first_page(pdf_path):
     """
-    Extract text from the first page of a PDF using PyMuPDF's dictionary-based extraction
-    which preserves more structural information and handles text better.
+    Extract text from the first page of a PDF using PyMuPDF's plain text extraction,
+    which keeps one line of text per output line without building per-span objects.
     """
     if not os.path.exists(pdf_path):
         print(f"Error: File not found - {pdf_path}")
         return ""
     
     try:
-        doc = fitz.open(pdf_path)
-        if len(doc) == 0:
-            print("PDF has no pages")
-            doc.close()
+        doc = open_pdf_mapped(pdf_path)
+    except Exception as e:
+        print(f"Error extracting text from {os.path.basename(pdf_path)}: {e}")
+        return ""
+    
+    try:
+        # page_count and load_page(0) only resolve the first page object;
+        # MuPDF loads the other pages lazily, so they are never parsed here
+        if doc.page_count == 0:
+            print(f"PDF has no pages: {os.path.basename(pdf_path)}")
             return ""
             
         # Get the first page
-        page = doc[0]
-        
-        # Use dictionary extraction for better text representation
-        text_dict = page.get_text("dict")
+        page = doc.load_page(0)
         
-        # Extract all text, preserving some structure
-        all_text = ""
-        for block in text_dict["blocks"]:
-            if block["type"] == 0:  # Text block
-                for line in block["lines"]:
-                    line_text = ""
-                    for span in line["spans"]:
-                        line_text += span["text"]
-                    all_text += line_text + "\n"
+        # A page without fonts, annotations or form fields is image-only (scanned)
+        # and has no titles to find; skip interpreting its content and decoding
+        # its images
+        if (not page.get_fonts() and page.first_annot is None
+                and page.first_widget is None):
+            return ""
         
-        doc.close()
-        return all_text
+        # Plain text extraction is all the title search needs
+        return page.get_text("text")
         
     except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
+        print(f"Error extracting text from {os.path.basename(pdf_path)}: {e}")
         return ""
+    finally:
+        doc.close()
 
-def check_graph_titles(text, expected_titles):
+def count_words(text):
     """
-    Check if the text contains the expected ECG graph titles for a specific format.
+    Count the words of the text once, so every format can be checked against
+    the same counts.
     
     Args:
         text (str): The extracted text from the PDF
+        
+    Returns:
+        Counter: Occurrences of each uppercased word, with a trailing
+                 colon (e.g. "V1:") removed
+    """
+    # Normalize text: uppercase
+    return Counter(word.rstrip(':') for word in text.upper().split())
+
+def check_graph_titles(word_counts, expected_titles):
+    """
+    Check if the text contains the expected ECG graph titles for a specific format.
+    
+    Args:
+        word_counts (Counter): Word counts of the extracted text, from count_words
         expected_titles (dict): The dictionary of expected titles and their counts
         
     Returns:
@@ -110,37 +171,10 @@ def check_graph_titles(text, expected_titles):
         "found_titles": []
     }
     
-    # Process text to handle variations
-    # Normalize text: uppercase, clean spaces
-    processed_text = text.upper()
-    
-    # Count occurrences with more robust patterns
+    # Look up each title in the word counts and analyze it in the same pass
     for title, expected_count in expected_titles.items():
-        title_upper = title.upper()
-        
-        # Different regex patterns to try:
-        patterns = [
-            rf'\b{re.escape(title_upper)}\b',  # Standard word boundary
-            rf'{re.escape(title_upper)}(?=\s|$|:)',  # Followed by space, end or colon
-            rf'(?<=\s|^){re.escape(title_upper)}(?=\s|$|:)',  # Preceded by space or start, followed by space, end or colon
-        ]
-        
-        # Try each pattern
-        found = False
-        for pattern in patterns:
-            matches = re.findall(pattern, processed_text)
-            if matches:
-                count = len(matches)
-                actual_counts[title] = count
-                found = True
-                break
-        
-        if not found:
-            actual_counts[title] = 0
-    
-    # Analyze results
-    for title, expected_count in expected_titles.items():
-        actual_count = actual_counts[title]
+        actual_count = word_counts.get(title.upper(), 0)
+        actual_counts[title] = actual_count
         
         if actual_count == 0:
             diagnostics["missing_titles"].append(title)
@@ -163,33 +197,32 @@ def check_graph_titles(text, expected_titles):
         "diagnostics": diagnostics
     }
 
-def check_all_formats(text):
+def check_all_formats(text, allow_ambiguity_check=True):
     """
     Check the text against all defined ECG formats.
     
     Args:
         text (str): The extracted text from the PDF
+        allow_ambiguity_check (bool): If True, check every format so a PDF matching
+            more than one can be detected. If False, stop at the first match
         
     Returns:
-        tuple: (matching_format, validation_results) where matching_format is 
-               the name of the matching format or None if no match was found
+        dict: Validation results from check_graph_titles for each format name
+              that was checked
     """
-    matching_format = None
-    matching_results = None
+    # Tokenize once; each format is then just a lookup against the same counts
+    word_counts = count_words(text)
     
+    format_results = {}
     for format_name, format_titles in ECG_FORMATS.items():
-        results = check_graph_titles(text, format_titles)
-        if results["is_valid"]:
-            # If we already found a matching format, we have an ambiguity
-            if matching_format is not None:
-                print(f"Warning: PDF matches multiple formats: {matching_format} and {format_name}")
-                return None, None  # Ambiguous format match
-            matching_format = format_name
-            matching_results = results
+        results = check_graph_titles(word_counts, format_titles)
+        format_results[format_name] = results
+        if results["is_valid"] and not allow_ambiguity_check:
+            break
     
-    return matching_format, matching_results
+    return format_results
 
-def validate_ecg_format(pdf_path, verbose=False):
+def validate_ecg_format(pdf_path, verbose=False, allow_ambiguity_check=True):
     """
     Validate if a PDF's first page contains the expected ECG graph titles
     for any of the supported formats.
@@ -197,13 +230,24 @@ def validate_ecg_format(pdf_path, verbose=False):
     Args:
         pdf_path (str): Path to the PDF file
         verbose (bool): If True, prints detailed diagnostic information
+        allow_ambiguity_check (bool): If False, accept the first matching format
+            without checking the remaining ones
         
     Returns:
         tuple: (matching_format, validation_results) where matching_format is 
                the name of the matching format or None if no match was found
     """
     text = extract_text_from_first_page(pdf_path)
-    matching_format, results = check_all_formats(text)
+    format_results = check_all_formats(text, allow_ambiguity_check=allow_ambiguity_check)
+    
+    matching_formats = [name for name, results in format_results.items() if results["is_valid"]]
+    matching_format = None
+    results = None
+    if len(matching_formats) > 1:
+        print(f"Warning: PDF matches multiple formats: {' and '.join(matching_formats)}")
+    elif matching_formats:
+        matching_format = matching_formats[0]
+        results = format_results[matching_format]
     
     if verbose:
         print(f"\nECG Format Validation Results for: {os.path.basename(pdf_path)}")
@@ -213,21 +257,42 @@ def validate_ecg_format(pdf_path, verbose=False):
         else:
             print("No valid ECG format detected")
             
-            # Try each format to show diagnostics
-            for format_name, format_titles in ECG_FORMATS.items():
-                format_results = check_graph_titles(text, format_titles)
+            # Show diagnostics for each format
+            for format_name, results_for_format in format_results.items():
                 print(f"\nFormat '{format_name}' validation:")
                 
-                if format_results['diagnostics']['missing_titles']:
-                    print(f"  Missing titles: {', '.join(format_results['diagnostics']['missing_titles'])}")
+                if results_for_format['diagnostics']['missing_titles']:
+                    print(f"  Missing titles: {', '.join(results_for_format['diagnostics']['missing_titles'])}")
                 
-                if format_results['diagnostics']['unexpected_counts']:
+                if results_for_format['diagnostics']['unexpected_counts']:
                     print("  Unexpected counts:")
-                    for title, counts in format_results['diagnostics']['unexpected_counts'].items():
+                    for title, counts in results_for_format['diagnostics']['unexpected_counts'].items():
                         print(f"    {title}: expected {counts['expected']}, found {counts['actual']}")
     
     return matching_format, results
 
+def _validate_pdf_worker(pdf_path, verbose=False):
+    """
+    Process-pool entry point for validate_ecg_format. Everything it prints is
+    captured and returned, so the parent can show it under the file's own
+    progress line instead of interleaved with other workers' output.
+    
+    Returns:
+        tuple: (matching_format, error, log) where error is the exception message
+               if validation raised, otherwise None, and log is the captured output
+    """
+    log = io.StringIO()
+    with redirect_stdout(log):
+        try:
+            # The formats differ in their expected counts, so a PDF can match at most
+            # one of them and the ambiguity check can be skipped
+            matching_format, _ = validate_ecg_format(pdf_path, verbose=verbose,
+                                                     allow_ambiguity_check=False)
+            error = None
+        except Exception as e:
+            matching_format, error = None, str(e)
+    return matching_format, error, log.getvalue()
+
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description='Validate and sort ECG PDF files')
@@ -269,7 +334,9 @@ def main():
         print(f"  Valid ECGs ({format_name}): {format_path}")
     
     # Get all PDF files in the input folder
-    pdf_files = [f for f in input_path.iterdir() if f.is_file() and f.suffix.lower() == '.pdf']
+    # os.scandir entries know whether they are files without an extra stat() call
+    with os.scandir(input_path) as it:
+        pdf_files = [e for e in it if e.is_file() and e.name.lower().endswith('.pdf')]
     
     # Statistics
     stats = {
@@ -284,34 +351,44 @@ def main():
     # Process each PDF file
     print(f"\nProcessing {stats['total']} PDF files...")
     
-    for i, pdf_file in enumerate(pdf_files, 1):
-        print(f"[{i}/{stats['total']}] Validating: {pdf_file.name}")
+    # Validate the PDFs in parallel; results come back in input order
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(_validate_pdf_worker,
+                               [f.path for f in pdf_files],
+                               [args.verbose] * len(pdf_files),
+                               chunksize=8)
         
-        try:
-            # Validate the PDF
-            matching_format, _ = validate_ecg_format(str(pdf_file), verbose=args.verbose)
+        for i, (pdf_file, (matching_format, error, log)) in enumerate(zip(pdf_files, results), 1):
+            print(f"[{i}/{stats['total']}] Validating: {pdf_file.name}")
+            if log:
+                print(log, end="")
+            
+            if error is None:
+                try:
+                    # Link (or copy) to appropriate folder
+                    if matching_format:
+                        stats['correct'] += 1
+                        format_stats[matching_format] += 1
+                        dest = format_paths[matching_format] / pdf_file.name
+                        print(f"✅ Valid ECG ({matching_format}): Linking to {dest}")
+                        link_or_copy(pdf_file, dest)
+                    else:
+                        stats['incorrect'] += 1
+                        dest = incorrect_path / pdf_file.name
+                        print(f"❌ Invalid ECG: Linking to {dest}")
+                        link_or_copy(pdf_file, dest)
+                except Exception as e:
+                    error = str(e)
             
-            # Copy to appropriate folder
-            if matching_format:
-                stats['correct'] += 1
-                format_stats[matching_format] += 1
-                dest = format_paths[matching_format] / pdf_file.name
-                print(f"✅ Valid ECG ({matching_format}): Copying to {dest}")
-                shutil.copy2(pdf_file, dest)
-            else:
+            if error is not None:
                 stats['incorrect'] += 1
                 dest = incorrect_path / pdf_file.name
-                print(f"❌ Invalid ECG: Copying to {dest}")
-                shutil.copy2(pdf_file, dest)
-        except Exception as e:
-            stats['incorrect'] += 1
-            dest = incorrect_path / pdf_file.name
-            print(f"❌ Error validating {pdf_file.name}: {str(e)}")
-            print(f"  Treating as invalid and copying to {dest}")
-            try:
-                shutil.copy2(pdf_file, dest)
-            except Exception as copy_err:
-                print(f"  Error copying file: {str(copy_err)}")
+                print(f"❌ Error validating {pdf_file.name}: {error}")
+                print(f"  Treating as invalid and linking to {dest}")
+                try:
+                    link_or_copy(pdf_file, dest)
+                except Exception as copy_err:
+                    print(f"  Error linking file: {str(copy_err)}")
     
     # Print summary
     print("\n" + "="*50)